@@ -6,7 +6,12 @@ from typing import List, Union, Callable, Awaitable, Dict, Optional
 from starlette.responses import StreamingResponse
 from pydantic import BaseModel, Field
 
+_HASH_FIELDS = ("messages",)
+
 class IsAlive( bt.Synapse ):   
+    class Config:
+        copy_on_model_validation = 'none'
+
     answer: typing.Optional[ str ] = None
     completion: str = pydantic.Field(
         "",
@@ -19,6 +24,9 @@ class ImageResponse( bt.Synapse):
     A class to represent the response for an image-related request.
     """
 
+    class Config:
+        copy_on_model_validation = 'none'
+
     completion: Optional[Dict] = pydantic.Field(
         None,
         title="Completion",
@@ -56,7 +64,7 @@ class ImageResponse( bt.Synapse):
     )
 
     required_hash_fields: List[str] = pydantic.Field(
-        ["messages"],
+        default_factory=lambda: list(_HASH_FIELDS),
         title="Required Hash Fields",
         description="A list of fields required for the hash."
     )
@@ -72,6 +80,9 @@ class Embeddings( bt.Synapse):
     A class to represent the embeddings request and response.
     """
 
+    class Config:
+        copy_on_model_validation = 'none'
+
     texts: List[str] = pydantic.Field(
         ...,
         title="Text",
@@ -92,6 +103,9 @@ class Embeddings( bt.Synapse):
 
 class StreamPrompting( bt.StreamingSynapse ):
 
+    class Config:
+        copy_on_model_validation = 'none'
+
     messages: List[Dict[str, str]] = pydantic.Field(
         ...,
         title="Messages",
@@ -100,7 +114,7 @@ class StreamPrompting( bt.StreamingSynapse ):
     )
 
     required_hash_fields: List[str] = pydantic.Field(
-        ["messages"],
+        default_factory=lambda: list(_HASH_FIELDS),
         title="Required Hash Fields",
         description="A list of required fields for the hash.",
         allow_mutation=False,
@@ -125,38 +139,39 @@ class StreamPrompting( bt.StreamingSynapse ):
     )
 
     async def process_streaming_response(self, response: StreamingResponse):
-        if self.completion is None:
-            self.completion = ""
-        async for chunk in response.content.iter_any():
-            tokens = chunk.decode("utf-8")
-            for token in tokens:
-                if token:
-                    self.completion += token
-            yield tokens
+        chunks = [self.completion or ""]
+        try:
+            async for chunk in response.content.iter_any():
+                tokens = chunk.decode("utf-8")
+                if tokens:
+                    chunks.append(tokens)
+                yield tokens
+        finally:
+            # Assign once: every assignment to a synapse field goes through pydantic validation
+            self.completion = "".join(chunks)
 
     def deserialize(self) -> str:
         return self.completion
 
     def extract_response_json(self, response: StreamingResponse) -> dict:
-        headers = {
-            k.decode("utf-8"): v.decode("utf-8")
-            for k, v in response.__dict__["_raw_headers"]
-        }
-
-        def extract_info(prefix):
-            return {
-                key.split("_")[-1]: value
-                for key, value in headers.items()
-                if key.startswith(prefix)
-            }
+        # Decode and partition the headers in a single pass
+        headers, dendrite, axon = {}, {}, {}
+        for k, v in response.__dict__["_raw_headers"]:
+            key, value = k.decode("utf-8"), v.decode("utf-8")
+            if key.startswith("bt_header_dendrite"):
+                dendrite[key.rsplit("_", 1)[-1]] = value
+            elif key.startswith("bt_header_axon"):
+                axon[key.rsplit("_", 1)[-1]] = value
+            else:
+                headers[key] = value
 
         return {
             "name": headers.get("name", ""),
             "timeout": float(headers.get("timeout", 0)),
             "total_size": int(headers.get("total_size", 0)),
             "header_size": int(headers.get("header_size", 0)),
-            "dendrite": extract_info("bt_header_dendrite"),
-            "axon": extract_info("bt_header_axon"),
+            "dendrite": dendrite,
+            "axon": axon,
             "messages": self.messages,
             "completion": self.completion,
         }
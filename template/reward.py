@@ -222,4 +222,43 @@ async def embeddings_score_dot(openai_answer: List, response: List, weight: floa
         return weight
     else:
         bt.logging.info(f"Average embeddings cosine similarity does not exceed threshold: {avg_cosine_similarity}")
-        return 0
\ No newline at end of file
+        return 0
+
+
+async def embeddings_score_dot_batch(openai_answers: List, responses: List, weight: float, threshold=.95) -> List[float]:
+    """Score many (openai_answer, response) pairs like embeddings_score_dot, using one tensor computation per shape."""
+    scores = [0] * len(openai_answers)
+
+    # Group pairs by number of embeddings so each group stacks into a (U, N, D) tensor
+    groups = {}
+    for i, (openai_answer, response) in enumerate(zip(openai_answers, responses)):
+        if not openai_answer or len(openai_answer) != len(response):
+            bt.logging.warning("The number of embeddings in openai_answer and response do not match.")
+            continue
+        groups.setdefault(len(openai_answer), []).append(i)
+
+    for indices in groups.values():
+        try:
+            oa_embs = torch.tensor([openai_answers[i] for i in indices], dtype=torch.float32)
+            resp_embs = torch.tensor([responses[i] for i in indices], dtype=torch.float32)
+            if oa_embs.shape != resp_embs.shape:
+                raise ValueError("embedding dimensions do not match")
+        except (ValueError, TypeError):
+            # Ragged or mismatched embedding dimensions, fall back to scoring each pair on its own
+            for i in indices:
+                scores[i] = await embeddings_score_dot(openai_answers[i], responses[i], weight, threshold)
+            continue
+
+        norms = oa_embs.norm(dim=-1) * resp_embs.norm(dim=-1)
+        has_zero_vector = (norms == 0).any(dim=-1)
+        cosine_similarities = ((oa_embs * resp_embs).sum(dim=-1) / norms).clamp(-1.0, 1.0)
+        avg_cosine_similarities = cosine_similarities.mean(dim=-1)
+
+        for i, zero_vector, avg_cosine_similarity in zip(indices, has_zero_vector.tolist(), avg_cosine_similarities.tolist()):
+            if zero_vector:
+                bt.logging.error("One of the embeddings is a zero vector.")
+                continue
+            bt.logging.info(f"Average similarity: {avg_cosine_similarity}")
+            scores[i] = weight if avg_cosine_similarity > threshold else 0
+
+    return scores
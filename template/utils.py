@@ -1,31 +1,53 @@
 import re
 import os
 import ast
+import time
 import math
-import json
+import orjson
 import wandb
 import base64
+import hashlib
+import sqlite3
 import random
 import asyncio
+import itertools
+import numpy as np
 import template
 import requests
+import threading
 import traceback
 import bittensor as bt
 from . import client
 from collections import deque
 
-list_update_lock = asyncio.Lock()
+list_update_locks = {"text": asyncio.Lock(), "images": asyncio.Lock()}
+_THEMES = {"images": template.IMAGE_THEMES, "text": template.INSTRUCT_DEFAULT_THEMES}
+
+_TAB_TABLE = str.maketrans('', '', '\t')
+_APOS_WORD_RE = re.compile(r"(?<=\w)'(?=\w)")
+_COMMENT_RE = re.compile(r'#[^"\n]*')
+_OPEN_BRACKET_WS_RE = re.compile(r"\[\s+")
+_CLOSE_BRACKET_WS_RE = re.compile(r"\s+\]")
+_WS_RE = re.compile(r"\s*,\s*")
+_STRAY_QUOTE_RE = re.compile(r'(?<![\[,])(?<!, )"(?![,\]])')
+_NUM_DOT_RE = re.compile(r'\d+\.\s')
+_LIST_RE = re.compile(r'\[((?:[^][]|"(?:\\.|[^"\\])*")*)\]', re.DOTALL)
+_VERSION_RE = re.compile(r'__version__ = "(.*?)"')
+
+_rng = np.random.default_rng()
+_COMPLEXITY_RELEVANCE_PAIRS = [(c, r) for c in range(1, 21) for r in range(1, 21)]
+_TEXT_PROMPT_TEMPLATE = "Generate a python-formatted list of {n} questions or instruct tasks related to the theme '{theme}', each with a complexity level of {complexity} out of 20 and a relevance level to the theme of {relevance} out of 20. These tasks should varyingly explore {theme} in a manner that is consistent with their assigned complexity and relevance levels to the theme, allowing for a diverse and insightful engagement about {theme}. Format the questions as comma-separated, quote-encapsulated strings in a single Python list."
 
 def load_state_from_file(filename="validators/state.json"):
     if os.path.exists(filename):
-        with open(filename, "r") as file:
+        with open(filename, "rb") as file:
             bt.logging.info("loaded previous state")
-            return json.load(file)
+            return orjson.loads(file.read())
     else:
         bt.logging.info("initialized new global state")
         return {
-            "text": {"themes": None, "questions": None, "theme_counter": 0, "question_counter": 0},
-            "images": {"themes": None, "questions": None, "theme_counter": 0, "question_counter": 0}
+            "text": {"questions": None, "theme_counter": 0, "question_counter": 0},
+            "images": {"questions": None, "theme_counter": 0, "question_counter": 0}
         }
 
 state = load_state_from_file()
@@ -39,9 +61,9 @@ def get_state():
 
 
 def save_state_to_file(state, filename="state.json"):
-    with open(filename, "w") as file:
+    with open(filename, "wb") as file:
         bt.logging.success(f"saved global state to {filename}")
-        json.dump(state, file)
+        file.write(orjson.dumps(state))
 
 
 def get_validators_with_runs_in_all_projects():
@@ -75,15 +97,12 @@ async def get_list(list_type, num_questions_needed, theme=None):
         
     selected_prompts = []
     if list_type == "text_questions":
-        question_pool = []
-        for complexity_level in range(1, 21): 
-            for relevance_level in range(1, 21):
-                prompt = f"Generate a python-formatted list of {prompts_in_question[list_type]} questions or instruct tasks related to the theme '{theme}', each with a complexity level of {complexity_level} out of 20 and a relevance level to the theme of {relevance_level} out of 20. These tasks should varyingly explore {theme} in a manner that is consistent with their assigned complexity and relevance levels to the theme, allowing for a diverse and insightful engagement about {theme}. Format the questions as comma-separated, quote-encapsulated strings in a single Python list."
-                question_pool.append(prompt)
-        
-        random.shuffle(question_pool)
-        num_questions_to_select = min(math.ceil(num_questions_needed / prompts_in_question[list_type]), len(question_pool))
-        selected_prompts = random.sample(question_pool, num_questions_to_select)
+        num_questions_to_select = min(math.ceil(num_questions_needed / prompts_in_question[list_type]), len(_COMPLEXITY_RELEVANCE_PAIRS))
+        selected_pairs = (_COMPLEXITY_RELEVANCE_PAIRS[idx] for idx in _rng.choice(len(_COMPLEXITY_RELEVANCE_PAIRS), size=num_questions_to_select, replace=False))
+        selected_prompts = [
+            _TEXT_PROMPT_TEMPLATE.format(n=prompts_in_question[list_type], theme=theme, complexity=complexity_level, relevance=relevance_level)
+            for complexity_level, relevance_level in selected_pairs
+        ]
     else:
         num_questions_to_select = math.ceil(num_questions_needed / prompts_in_question[list_type])
         selected_prompts = [list_type_mapping[list_type]["prompt"]] * num_questions_to_select
@@ -96,14 +115,14 @@ async def get_list(list_type, num_questions_needed, theme=None):
     ]
 
     responses = await asyncio.gather(*tasks)
-    extracted_lists = []
+    extracted_chunks = []
     max_retries = 5
     for i, answer in enumerate(responses):
         try:
             answer = answer.replace("\n", " ") if answer else ""
             extracted_list = extract_python_list(answer)
             if extracted_list:
-                extracted_lists += extracted_list
+                extracted_chunks.append(extracted_list)
             else:
                 # Retry logic for each prompt if needed
                 for retry in range(max_retries):
@@ -114,7 +133,7 @@ async def get_list(list_type, num_questions_needed, theme=None):
                         new_answer = new_answer.replace("\n", " ") if new_answer else ""
                         new_extracted_list = extract_python_list(new_answer)
                         if new_extracted_list:
-                            extracted_lists += new_extracted_list
+                            extracted_chunks.append(new_extracted_list)
                             break
                         else: bt.logging.error(f"no list found in {new_answer}")
                     except Exception as e:
@@ -122,6 +141,7 @@ async def get_list(list_type, num_questions_needed, theme=None):
         except Exception as e:
             bt.logging.error(f"Exception in processing initial response for prompt '{selected_prompts[i]}': {e}\n{traceback.format_exc()}")
 
+    extracted_lists = list(itertools.chain.from_iterable(extracted_chunks))
     if not extracted_lists:
         bt.logging.error(f"No valid lists found after processing and retries, returning None")
         return None
@@ -132,28 +152,19 @@ async def get_list(list_type, num_questions_needed, theme=None):
 async def update_counters_and_get_new_list(category, item_type, num_questions_needed, theme=None):
 
     async def get_items(category, item_type, theme=None):
-        if item_type == "themes":
-            if category == "images":
-                return template.IMAGE_THEMES
-            else:
-                return template.INSTRUCT_DEFAULT_THEMES
-        else:
-            # Never fail here, retry until valid list is found
-            while True:
-                theme = await get_random_theme(category)
-                if theme is not None:
-                    return await get_list(f"{category}_questions", num_questions_needed, theme)
+        # Never fail here, retry until valid list is found
+        while True:
+            theme = await get_random_theme(category)
+            if theme is not None:
+                return await get_list(f"{category}_{item_type}", num_questions_needed, theme)
 
     async def get_random_theme(category):
-        themes = state[category]["themes"]
-        if not themes:
-            themes = await get_items(category, "themes")
-            state[category]["themes"] = themes
-        return random.choice(themes)
+        # Themes are constant, no need to go through the state or the lock
+        return random.choice(_THEMES[category])
 
     list_type = f"{category}_{item_type}"
 
-    async with list_update_lock:
+    async with list_update_locks[category]:
         items = state[category][item_type]
 
         # Logging the current state before fetching new items
@@ -181,99 +192,42 @@ async def get_question(category, num_questions_needed):
 
 
 def preprocess_string(text):
-    processed_text = text.replace("\t", "")
+    processed_text = text.translate(_TAB_TABLE)
     placeholder = "___SINGLE_QUOTE___"
-    processed_text = re.sub(r"(?<=\w)'(?=\w)", placeholder, processed_text)
+    processed_text = _APOS_WORD_RE.sub(placeholder, processed_text)
     processed_text = processed_text.replace("'", '"').replace(placeholder, "'")
 
-    # First, remove all comments, ending at the next quote
-    no_comments_text = ""
-    i = 0
-    in_comment = False
-    while i < len(processed_text):
-        if processed_text[i] == '#':
-            in_comment = True
-        elif processed_text[i] == '"' and in_comment:
-            in_comment = False
-            no_comments_text += processed_text[i]  # Keep the quote that ends the comment
-            i += 1
-            continue
-        if not in_comment:
-            no_comments_text += processed_text[i]
-        i += 1
-
-    # Now process the text without comments for quotes
-    cleaned_text = []
-    inside_quotes = False
-    found_first_bracket = False
-
-    i = 0
-    while i < len(no_comments_text):
-        char = no_comments_text[i]
-
-        if not found_first_bracket:
-            if char == '[':
-                found_first_bracket = True
-            cleaned_text.append(char)
-            i += 1
-            continue
-
-        if char == '"':
-            # Look for preceding comma or bracket, skipping spaces
-            preceding_char_index = i - 1
-            found_comma_or_bracket = False
-
-            while preceding_char_index >= 0:
-                if no_comments_text[preceding_char_index] in '[,':  # Check for comma or opening bracket
-                    found_comma_or_bracket = True
-                    break
-                elif no_comments_text[preceding_char_index] not in ' \n':  # Ignore spaces and new lines
-                    break
-                preceding_char_index -= 1
-
-            following_char_index = i + 1
-            while following_char_index < len(no_comments_text) and no_comments_text[following_char_index] in ' \n':
-                following_char_index += 1
-
-            if found_comma_or_bracket or \
-               (following_char_index < len(no_comments_text) and no_comments_text[following_char_index] in '],'):
-                inside_quotes = not inside_quotes
-            else:
-                i += 1
-                continue  # Skip this quote
-
-            cleaned_text.append(char)
-            i += 1
-            continue
-
-        if char == ' ':
-            # Skip spaces if not inside quotes and if the space is not between words
-            if not inside_quotes and (i == 0 or no_comments_text[i - 1] in ' ,[' or no_comments_text[i + 1] in ' ,]'):
-                i += 1
-                continue
-
-        cleaned_text.append(char)
-        i += 1
+    # Remove all comments, ending at the next quote (which is kept) or the end of the line
+    processed_text = _COMMENT_RE.sub("", processed_text)
 
-    cleaned_str = ''.join(cleaned_text)
-    cleaned_str = re.sub(r"\[\s+", "[", cleaned_str)
-    cleaned_str = re.sub(r"\s+\]", "]", cleaned_str)
-    cleaned_str = re.sub(r"\s*,\s*", ", ", cleaned_str)  # Ensure single space after commas
-
-    start, end = cleaned_str.find('['), cleaned_str.rfind(']')
+    start, end = processed_text.find('['), processed_text.rfind(']')
     if start != -1 and end != -1 and end > start:
-        cleaned_str = cleaned_str[start:end + 1]
+        processed_text = processed_text[start:end + 1]
+
+    processed_text = _OPEN_BRACKET_WS_RE.sub("[", processed_text)
+    processed_text = _CLOSE_BRACKET_WS_RE.sub("]", processed_text)
+    processed_text = _WS_RE.sub(", ", processed_text)  # Ensure single space after commas
 
-    return cleaned_str
+    # Drop quotes that don't delimit a list element, the JSON parser handles the rest
+    return _STRAY_QUOTE_RE.sub("", processed_text)
 
 def convert_to_list(text):
-    pattern = r'\d+\.\s'
-    items = [item.strip() for item in re.split(pattern, text) if item]
+    items = [item.strip() for item in _NUM_DOT_RE.split(text) if item]
     return items
 
 def extract_python_list(text: str):
     try:
-        if re.match(r'\d+\.\s', text):
+        # Fast path for responses that are already a clean JSON list, skipping preprocessing
+        text_stripped = text.lstrip()
+        if text_stripped.startswith('['):
+            try:
+                evaluated = orjson.loads(text_stripped[:text_stripped.rfind(']') + 1])
+                if isinstance(evaluated, list):
+                    return evaluated
+            except orjson.JSONDecodeError:
+                pass
+
+        if _NUM_DOT_RE.match(text):
             return convert_to_list(text)
         
         bt.logging.debug(f"Preprocessed text = {text}")
@@ -281,12 +235,15 @@ def extract_python_list(text: str):
         bt.logging.debug(f"Postprocessed text = {text}")
 
         # Extracting list enclosed in square brackets
-        match = re.search(r'\[((?:[^][]|"(?:\\.|[^"\\])*")*)\]', text, re.DOTALL)
+        match = _LIST_RE.search(text)
         if match:
             list_str = match.group(1)
 
-            # Using ast.literal_eval to safely evaluate the string as a list
-            evaluated = ast.literal_eval('[' + list_str + ']')
+            # Try the fast JSON parser first, fall back to ast.literal_eval for python-style literals
+            try:
+                evaluated = orjson.loads('[' + list_str + ']')
+            except orjson.JSONDecodeError:
+                evaluated = ast.literal_eval('[' + list_str + ']')
             if isinstance(evaluated, list):
                 return evaluated
 
@@ -318,26 +275,117 @@ async def call_openai(messages, temperature, model, seed=1234):
 
 
 
+async def call_openai_batch(messages_by_id, temperature, model, seed=1234, poll_timeout=600):
+    """Run chat completions through the OpenAI Batch API and return a dict of custom id -> response content."""
+    lines = [
+        orjson.dumps({
+            "custom_id": str(custom_id),
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {"model": model, "messages": messages, "temperature": temperature, "seed": seed},
+        })
+        for custom_id, messages in messages_by_id.items()
+    ]
+    batch_file = await client.files.create(file=("batch.jsonl", b"\n".join(lines)), purpose="batch")
+    batch = await client.batches.create(input_file_id=batch_file.id, endpoint="/v1/chat/completions", completion_window="24h")
+    bt.logging.debug(f"Created openai batch {batch.id} with {len(lines)} requests")
+
+    # Poll with exponential backoff until the batch finishes or we give up on it
+    delay = 1
+    deadline = time.monotonic() + poll_timeout
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        if time.monotonic() > deadline:
+            await client.batches.cancel(batch.id)
+            raise TimeoutError(f"openai batch {batch.id} did not complete within {poll_timeout} seconds")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 30)
+        batch = await client.batches.retrieve(batch.id)
+
+    if batch.status != "completed" or not batch.output_file_id:
+        raise RuntimeError(f"openai batch {batch.id} ended with status {batch.status}")
+
+    output = await client.files.content(batch.output_file_id)
+    responses = {}
+    for line in output.text.splitlines():
+        result = orjson.loads(line)
+        body = (result.get("response") or {}).get("body")
+        responses[result["custom_id"]] = body["choices"][0]["message"]["content"] if body else None
+    return responses
+
+
+class LLMCache:
+    """On-disk cache of OpenAI chat completions, keyed by a SHA-256 of the request parameters.
+
+    get/set block on sqlite, call them through asyncio.to_thread from async code.
+    """
+
+    def __init__(self, filename="validators/llm_cache.sqlite", ttl=None):
+        self.ttl = ttl
+        # Used from worker threads, the lock serializes access to the shared connection
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT, ts REAL)")
+        self.conn.commit()
+
+    @staticmethod
+    def make_key(messages, temperature, model, seed):
+        request = {"messages": messages, "temperature": temperature, "model": model, "seed": seed}
+        return hashlib.sha256(orjson.dumps(request, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT response, ts FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        response, ts = row
+        if self.ttl is not None and time.time() - ts > self.ttl:
+            return None
+        return response
+
+    def set(self, key, response):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO responses (key, response, ts) VALUES (?, ?, ?)", (key, response, time.time()))
+            self.conn.commit()
+
+
 # Github unauthorized rate limit of requests per hour is 60. Authorized is 5000.
-def get_version(line_number = 22):
-    url = f"https://api.github.com/repos/corcel-api/cortex.t/contents/template/__init__.py"
-    response = requests.get(url)
-    if response.status_code == 200:
-        content = response.json()['content']
-        decoded_content = base64.b64decode(content).decode('utf-8')
-        lines = decoded_content.split('\n')
-        if line_number <= len(lines):
-            version_line = lines[line_number - 1]
-            version_match = re.search(r'__version__ = "(.*?)"', version_line)
-            if version_match:
-                return version_match.group(1)
+# Conditional requests that come back 304 Not Modified don't count against the limit.
+_version_session = requests.Session()
+_version_cache = {"lines": None, "etag": "", "ts": 0.0}
+
+def get_version(line_number = 22, ttl = 60):
+    now = time.monotonic()
+    if _version_cache["lines"] is None or now - _version_cache["ts"] >= ttl:
+        url = f"https://api.github.com/repos/corcel-api/cortex.t/contents/template/__init__.py"
+        headers = {"If-None-Match": _version_cache["etag"]} if _version_cache["lines"] is not None and _version_cache["etag"] else {}
+        try:
+            response = _version_session.get(url, headers=headers, timeout=10)
+        except requests.RequestException as e:
+            # Fall back to the cached file, if there is one
+            bt.logging.error(f"github api call failed: {e}")
+            if _version_cache["lines"] is None:
+                return None
+        else:
+            if response.status_code == 200:
+                content = response.json()['content']
+                decoded_content = base64.b64decode(content).decode('utf-8')
+                _version_cache.update(lines=decoded_content.split('\n'), etag=response.headers.get("ETag", ""), ts=now)
+            elif response.status_code == 304:
+                _version_cache["ts"] = now
             else:
-                raise Exception("Version information not found in the specified line")
+                bt.logging.error("github api call failed")
+                return None
+
+    lines = _version_cache["lines"]
+    if line_number <= len(lines):
+        version_line = lines[line_number - 1]
+        version_match = _VERSION_RE.search(version_line)
+        if version_match:
+            return version_match.group(1)
         else:
-            raise Exception("Line number exceeds file length")
+            raise Exception("Version information not found in the specified line")
     else:
-        bt.logging.error("github api call failed")
-        return None
+        raise Exception("Line number exceeds file length")
 
 
 def send_discord_alert(message, webhook_url):
@@ -2,6 +2,7 @@ import wandb
 import torch
 import random
 import asyncio 
+import numpy as np
 import bittensor as bt
 import template.reward
 from template import client
@@ -16,6 +17,7 @@ class EmbeddingsValidator(BaseValidator):
         self.query_type = "embeddings"
         self.model = "text-embedding-ada-002"
         self.weight = 1
+        self.dataset_texts = {}
 
         self.wandb_data = {
             "modality": "embeddings",
@@ -29,16 +31,11 @@ class EmbeddingsValidator(BaseValidator):
         
         
         async def get_embeddings_in_batch(texts, model, batch_size=10):
-            batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
-            tasks = []
-            for batch in batches:
-                filtered_batch = [text for text in batch if text.strip()]
-                if filtered_batch:
-                    # bt.logging.info("Log prompt.", filtered_batch)
-                    task = asyncio.create_task(client.embeddings.create(input=filtered_batch, model=model, encoding_format='float'))
-                    tasks.append(task)
-                else:
-                    bt.logging.info("Skipped an empty batch.")
+            filtered_texts = [text for text in texts if text and not text.isspace()]
+            tasks = [
+                asyncio.create_task(client.embeddings.create(input=filtered_texts[i:i + batch_size], model=model, encoding_format='float'))
+                for i in range(0, len(filtered_texts), batch_size)
+            ]
             
             all_embeddings = []
             results = await asyncio.gather(*tasks, return_exceptions=True)
@@ -61,9 +58,11 @@ class EmbeddingsValidator(BaseValidator):
         return all_embeddings
 
     def get_random_texts(self, dataset_name, config_name, num_samples=100):
-        dataset = load_dataset(dataset_name, config_name)
-        texts = [item['text'] for item in dataset['train']] 
-        return random.sample(texts, num_samples)
+        # Load the train split's text column once and reuse it for every query
+        key = (dataset_name, config_name)
+        if key not in self.dataset_texts:
+            self.dataset_texts[key] = load_dataset(dataset_name, config_name, split='train')['text']
+        return random.sample(self.dataset_texts[key], num_samples)
 
     async def start_query(self, available_uids, metagraph):
         if not available_uids:
@@ -81,20 +80,20 @@ class EmbeddingsValidator(BaseValidator):
             end_index = start_index + num_texts_per_uid
             prompt = random_texts[start_index:end_index]
             uid_to_question[uid] = prompt
-            syn = Embeddings(model=self.model, texts=prompt)
+            # Trusted, locally built synapse: skip pydantic validation (construct bypasses the name root validator)
+            syn = Embeddings.construct(name=Embeddings.__name__, model=self.model, texts=prompt, embeddings=None)
             bt.logging.info(f"Sending {self.query_type} request to uid: {uid} using {syn.model} with timeout {self.timeout}: {syn.texts[0]}")
             task = self.query_miner(metagraph.axons[uid], uid, syn)
             query_tasks.append(task)
-            self.wandb_data["texts"][uid] = prompt
+        self.wandb_data["texts"].update(uid_to_question)
 
         query_responses = await asyncio.gather(*query_tasks)
         return query_responses, uid_to_question
 
     async def score_responses(self, query_responses, uid_to_question, metagraph):
-        scores = torch.zeros(len(metagraph.hotkeys))
+        scores = np.zeros(len(metagraph.hotkeys), dtype=np.float32)
         uid_scores_dict = {}
         embedding_score_tasks = []
-        scoring_tasks = []
 
         random_number = random.random()
         will_score_all = random_number < 1/1.1
@@ -109,29 +108,31 @@ class EmbeddingsValidator(BaseValidator):
         # Await all embedding tasks
         embeddings_results = await asyncio.gather(*[task for _, task in embedding_score_tasks])
 
-      
-        # Now create new tasks for scoring embeddings
+        # Collect the embeddings to score, then score every uid in one batched computation
+        uid_to_response = dict(query_responses)
+        scored_uids = []
+        openai_answers = []
+        response_embeddings = []
         for (uid, _), openai_answer in zip(embedding_score_tasks, embeddings_results):
             if openai_answer:
-                response = next(res for u, res in query_responses if u == uid)
-                response = response[0]
+                response = uid_to_response[uid][0]
                 if response.embeddings is not None:
-                    response_embeddings = response.embeddings
-                    task = template.reward.embeddings_score_dot(openai_answer, response_embeddings, self.weight)
-                    scoring_tasks.append((uid, task))
+                    scored_uids.append(uid)
+                    openai_answers.append(openai_answer)
+                    response_embeddings.append(response.embeddings)
                 else:
                     scores[uid] = 0
                     uid_scores_dict[uid] = 0
 
-        # Await all scoring tasks
-        scored_responses = await asyncio.gather(*[task for _, task in scoring_tasks])
+        scored_responses = await template.reward.embeddings_score_dot_batch(openai_answers, response_embeddings, self.weight)
 
-        for (uid, _), score in zip(scoring_tasks, scored_responses):  # Use scoring_tasks here
+        wandb_scores = self.wandb_data["scores"]
+        for uid, score in zip(scored_uids, scored_responses):
             scores[uid] = score if score is not None else 0
-            uid_scores_dict[uid] = scores[uid]
-            self.wandb_data["scores"][uid] = score
+            uid_scores_dict[uid] = float(scores[uid])
+            wandb_scores[uid] = score
 
-        return scores, uid_scores_dict, self.wandb_data
+        return torch.from_numpy(scores), uid_scores_dict, self.wandb_data
 
     async def get_and_score(self, available_uids, metagraph):
         query_responses, uid_to_question = await self.start_query(available_uids, metagraph)
@@ -26,6 +26,7 @@ class ImageValidator(BaseValidator):
         self.size = "1792x1024"
         self.quality = "standard"
         self.style = "vivid"
+        self.session = None
 
         self.wandb_data = {
             "modality": "images",
@@ -42,21 +43,31 @@ class ImageValidator(BaseValidator):
         uid_to_messages = {}
         for uid in available_uids:
             messages = await get_question("images", len(available_uids))
+            if not isinstance(messages, str) or not messages:
+                bt.logging.error(f"Skipping uid {uid}, invalid image question: {messages!r}")
+                continue
             uid_to_messages[uid] = messages  # Store messages for each UID
-            syn = ImageResponse(messages=messages, model=self.model, size=self.size, quality=self.quality, style=self.style)
+            # Fields are checked above, skip pydantic validation (construct bypasses the name root validator)
+            syn = ImageResponse.construct(name=ImageResponse.__name__, messages=messages, model=self.model, size=self.size, quality=self.quality, style=self.style)
             bt.logging.info(f"Sending a {self.size} {self.quality} {self.style} {self.query_type} request to uid: {uid} using {syn.model} with timeout {self.timeout}: {syn.messages}")
             task = self.query_miner(metagraph.axons[uid], uid, syn)
             query_tasks.append(task)
-            self.wandb_data["prompts"][uid] = messages
+        self.wandb_data["prompts"].update(uid_to_messages)
 
         query_responses = await asyncio.gather(*query_tasks)
         return query_responses, uid_to_messages
 
+    async def get_session(self):
+        # Reuse one session (and its connection pool) for every download, it has to be created inside the event loop
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession()
+        return self.session
+
     async def download_image(self, url):
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                content = await response.read()
-                return Image.open(BytesIO(content))
+        session = await self.get_session()
+        async with session.get(url) as response:
+            content = await response.read()
+            return Image.open(BytesIO(content))
 
     async def score_responses(self, query_responses, uid_to_messages, metagraph):
         scores = torch.zeros(len(metagraph.hotkeys))
@@ -93,11 +104,13 @@ class ImageValidator(BaseValidator):
                 uid_scores_dict[uid] = 0
 
         # Wait for all download tasks to complete
+        wandb_images = self.wandb_data["images"]
+        wandb_responses = self.wandb_data["responses"]
         for uid, download_task, image_url in download_tasks:
             image = await download_task
             # Log the image to wandb
-            self.wandb_data["images"][uid] = wandb.Image(image)
-            self.wandb_data["responses"][uid] = {"url": image_url}
+            wandb_images[uid] = wandb.Image(image)
+            wandb_responses[uid] = {"url": image_url}
             # self.wandb_data["timestamps"][uid] = datetime.datetime.now().isoformat()
 
         # Await all scoring tasks concurrently
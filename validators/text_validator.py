@@ -1,4 +1,5 @@
 
+import os
 import math
 import torch
 import wandb
@@ -9,7 +10,7 @@ import bittensor as bt
 
 from base_validator import BaseValidator
 from template.protocol import StreamPrompting
-from template.utils import call_openai, get_question
+from template.utils import LLMCache, call_openai, call_openai_batch, get_question
 
 
 class TextValidator(BaseValidator):
@@ -20,6 +21,22 @@ class TextValidator(BaseValidator):
         self.model = "gpt-4-1106-preview"
         self.weight = 1
         self.seed = 1234
+        # Separate limits, so reference answers never hold slots the miner queries need
+        self.semaphore = asyncio.Semaphore(getattr(config, "max_concurrency", None) or 256)
+        self.openai_semaphore = asyncio.Semaphore(getattr(config, "max_openai_concurrency", None) or 256)
+        self.llm_cache = LLMCache() if os.environ.get("CORTEXT_LLM_CACHE") == "1" else None
+        # Rounds with at least this many responses use the OpenAI Batch API, 0 disables it
+        self.batch_threshold = getattr(config, "openai_batch_threshold", None) or 0
+        self.syn_proto = StreamPrompting(messages=[], model=self.model, seed=self.seed)
+        self.trace_on = getattr(bt.logging, "__trace_on__", False)
+        self.score_rng = random.Random()
+        self.will_score_all = False
+        self.reference_tasks = {}
+        # Questions prefetched in the background by refill_questions
+        self.question_pool = asyncio.Queue()
+        self.question_pool_not_full = asyncio.Event()
+        self.question_qty = 0
+        self.refill_task = None
 
         self.wandb_data = {
             "modality": "text",
@@ -29,88 +46,218 @@ class TextValidator(BaseValidator):
             "timestamps": {},
         }
 
+    async def next_question(self, qty):
+        if qty > self.question_qty:
+            # A larger round raises the pool's fill target, wake the refill task
+            self.question_pool_not_full.set()
+        self.question_qty = qty
+        if self.refill_task is None or self.refill_task.done():
+            self.refill_task = asyncio.create_task(self.refill_questions())
+        question = await self.question_pool.get()
+        self.question_pool_not_full.set()
+        return question
+
+    async def refill_questions(self):
+        """Keep the question pool at twice the current round size, waiting whenever it is full."""
+        while True:
+            if self.question_pool.qsize() >= 2 * self.question_qty:
+                self.question_pool_not_full.clear()
+                await self.question_pool_not_full.wait()
+                continue
+            try:
+                prompt = await get_question("text", self.question_qty)
+            except Exception as e:
+                bt.logging.error(f"Exception while prefetching text question: {e}")
+                await asyncio.sleep(1)
+                continue
+            if not isinstance(prompt, str) or not prompt:
+                bt.logging.error(f"Prefetched text question is unusable: {prompt!r}")
+                await asyncio.sleep(1)
+                continue
+            self.question_pool.put_nowait(prompt)
+
+    async def query_miner(self, axon, uid, syn):
+        async with self.semaphore:
+            return await super().query_miner(axon, uid, syn)
+
+    async def call_openai(self, messages):
+        if self.llm_cache is None:
+            async with self.openai_semaphore:
+                return await call_openai(messages, 0, self.model, self.seed)
+
+        key = LLMCache.make_key(messages, 0, self.model, self.seed)
+        response = await asyncio.to_thread(self.llm_cache.get, key)
+        if response is None:
+            async with self.openai_semaphore:
+                response = await call_openai(messages, 0, self.model, self.seed)
+            if response:
+                await asyncio.to_thread(self.llm_cache.set, key, response)
+        return response
+
     async def organic(self, metagraph, query):
+        # Start every miner stream up front. One stream at a time is passed through live, the others are
+        # buffered so that each uid's answer is still yielded as one contiguous block
+        token_queue = asyncio.Queue()
+        stream_tasks = []
+        self.wandb_data["prompts"].update(query)
         for uid, messages in query.items():
+            # messages come from the external HTTP request, so they go through full validation
             syn = StreamPrompting(messages=messages, model=self.model, seed=self.seed)
-            bt.logging.info(f"Sending {syn.model} {self.query_type} request to uid: {uid}, timeout {self.timeout}: {syn.messages[0]['content']}")
-            self.wandb_data["prompts"][uid] = messages
-            responses = await self.dendrite(metagraph.axons[uid], syn, deserialize=False, timeout=self.timeout, streaming=self.streaming)
-            
-            async for response in self.return_tokens(uid, responses):
-                yield response
+            bt.logging.info(f"Sending {self.model} {self.query_type} request to uid: {uid}, timeout {self.timeout}: {messages[0]['content']}")
+            stream_tasks.append(asyncio.create_task(self.stream_tokens(metagraph.axons[uid], uid, syn, token_queue)))
+
+        buffers = {uid: [] for uid in query}
+        completed = []
+        live_uid = None
+        try:
+            remaining_streams = len(stream_tasks)
+            while remaining_streams:
+                uid, token = await token_queue.get()
+                if token is not None:
+                    if live_uid in (None, uid):
+                        live_uid = uid
+                        yield uid, token
+                    else:
+                        buffers[uid].append(token)
+                    continue
+
+                remaining_streams -= 1
+                completed.append(uid)
+                if live_uid not in (None, uid):
+                    continue
+
+                # The live stream ended: flush the streams that completed meanwhile, in completion order
+                for done_uid in completed:
+                    for token in buffers.pop(done_uid, []):
+                        yield done_uid, token
+                completed = []
+
+                # Then catch up on a stream that is still running and pass it through live from now on
+                live_uid = next((uid for uid, tokens in buffers.items() if tokens), None)
+                if live_uid is not None:
+                    for token in buffers[live_uid]:
+                        yield live_uid, token
+                    buffers[live_uid] = []
+        finally:
+            for task in stream_tasks:
+                task.cancel()
+
+    async def stream_tokens(self, axon, uid, syn, token_queue):
+        """Put (uid, token) pairs from a single miner stream on the queue, followed by (uid, None) when the stream ends."""
+        try:
+            async with self.semaphore:
+                responses = await self.dendrite(axon, syn, deserialize=False, timeout=self.timeout, streaming=self.streaming)
+                async for response in self.return_tokens(uid, responses):
+                    token_queue.put_nowait(response)
+        except Exception as e:
+            bt.logging.error(f"Exception during organic query for uid {uid}: {e}")
+        finally:
+            token_queue.put_nowait((uid, None))
 
     async def return_tokens(self, uid, responses):
         async for resp in responses:
             if isinstance(resp, str):
-                bt.logging.trace(resp)
+                if self.trace_on:
+                    bt.logging.trace(resp)
                 yield uid, resp
 
     async def handle_response(self, uid, responses):
-        full_response = ""
-        for resp in responses:
-            async for chunk in resp:
-                if isinstance(chunk, str):
+        if not responses:
+            return uid, ""
+
+        parts = []
+        async for chunk in responses[0]:
+            if isinstance(chunk, str):
+                if self.trace_on:
                     bt.logging.trace(chunk)
-                    full_response += chunk
-            bt.logging.debug(f"full_response for uid {uid}: {full_response}")
-            break
+                parts.append(chunk)
+        full_response = "".join(parts)
+        bt.logging.debug(f"full_response for uid {uid}: {full_response}")
         return uid, full_response
 
     async def start_query(self, available_uids, metagraph):
         query_tasks = []
         uid_to_question = {}
-        for uid in available_uids:
-            prompt = await get_question("text", len(available_uids))
+        # Decide whether this round is scored now, so reference answers can be generated while the miners stream
+        self.will_score_all = self.should_i_score()
+        bt.logging.info(f"Will score text responses: {self.will_score_all}")
+        start_references = self.will_score_all and not (self.batch_threshold and len(available_uids) >= self.batch_threshold)
+        prompts = await asyncio.gather(*[self.next_question(len(available_uids)) for _ in available_uids])
+        for uid, prompt in zip(available_uids, prompts):
+            if not isinstance(prompt, str) or not prompt:
+                bt.logging.error(f"Skipping uid {uid}, invalid text question: {prompt!r}")
+                continue
             uid_to_question[uid] = prompt
             messages = [{'role': 'user', 'content': prompt}]
-            syn = StreamPrompting(messages=messages, model=self.model, seed=self.seed)
-            bt.logging.info(f"Sending {syn.model} {self.query_type} request to uid: {uid}, timeout {self.timeout}: {syn.messages[0]['content']}")
+            syn = self.syn_proto.copy(update={"messages": messages})
+            bt.logging.info(f"Sending {self.model} {self.query_type} request to uid: {uid}, timeout {self.timeout}: {prompt}")
             task = self.query_miner(metagraph.axons[uid], uid, syn)
             query_tasks.append(task)
-            self.wandb_data["prompts"][uid] = prompt
+            if start_references:
+                self.reference_tasks[uid] = asyncio.create_task(self.call_openai(messages))
+        self.wandb_data["prompts"].update(uid_to_question)
 
         query_responses = await asyncio.gather(*query_tasks)
         return query_responses, uid_to_question
 
+    def should_i_score(self):
+        """Score all UIDs in roughly 1 out of 12 rounds, unpredictably."""
+        return self.score_rng.random() < 1/12
+
+    async def score_response(self, uid, response, prompt, reference_task=None):
+        """Generate (or await the already started) reference answer for a uid's prompt and score the miner response against it."""
+        if reference_task is not None:
+            openai_answer = await reference_task
+        else:
+            messages = [{'role': 'user', 'content': prompt}]
+            openai_answer = await self.call_openai(messages)
+        return await self.score_openai_answer(uid, response, openai_answer)
+
+    async def score_openai_answer(self, uid, response, openai_answer):
+        if not openai_answer:
+            return uid, None
+        scored_response = await template.reward.openai_score(openai_answer, response, self.weight)
+        return uid, scored_response if scored_response is not None else 0
+
     async def score_responses(self, query_responses, uid_to_question, metagraph):
-        scores = torch.zeros(len(metagraph.hotkeys))
+        scores = torch.zeros(len(metagraph.hotkeys), dtype=torch.float32)
         uid_scores_dict = {}
-        openai_response_tasks = []
-
-        # Decide to score all UIDs this round based on a chance
-        random_number = random.random()
-        will_score_all = random_number < 1/12
-        bt.logging.info(f"Random Number: {random_number}, Will score text responses: {will_score_all}")
+        reference_tasks, self.reference_tasks = self.reference_tasks, {}
 
+        responses_to_score = []
+        wandb_responses = self.wandb_data["responses"]
         for uid, response in query_responses:
-            self.wandb_data["responses"][uid] = response
-            if will_score_all and response:
-                prompt = uid_to_question[uid]
-                messages = [{'role': 'user', 'content': prompt}]
-                task = call_openai(messages, 0, self.model, self.seed)
-                openai_response_tasks.append((uid, task))
-
-        openai_responses = await asyncio.gather(*[task for _, task in openai_response_tasks])
+            wandb_responses[uid] = response
+            if self.will_score_all and response:
+                responses_to_score.append((uid, response))
+            elif uid in reference_tasks:
+                reference_tasks.pop(uid).cancel()
 
-        scoring_tasks = []
-        for (uid, _), openai_answer in zip(openai_response_tasks, openai_responses):
-            if openai_answer:
-                response = next(res for u, res in query_responses if u == uid)  # Find the matching response
-                task = template.reward.openai_score(openai_answer, response, self.weight)
-                scoring_tasks.append((uid, task))
+        scored_responses = None
+        if self.batch_threshold and len(responses_to_score) >= self.batch_threshold:
+            try:
+                messages_by_uid = {uid: [{'role': 'user', 'content': uid_to_question[uid]}] for uid, _ in responses_to_score}
+                openai_answers = await call_openai_batch(messages_by_uid, 0, self.model, self.seed)
+                scoring_tasks = [self.score_openai_answer(uid, response, openai_answers.get(str(uid))) for uid, response in responses_to_score]
+                scored_responses = await asyncio.gather(*scoring_tasks)
+            except Exception as e:
+                bt.logging.error(f"openai batch scoring failed, falling back to individual requests: {e}")
 
-        scored_responses = await asyncio.gather(*[task for _, task in scoring_tasks])
+        if scored_responses is None:
+            scoring_tasks = [self.score_response(uid, response, uid_to_question[uid], reference_tasks.get(uid)) for uid, response in responses_to_score]
+            scored_responses = await asyncio.gather(*scoring_tasks)
 
-        for (uid, _), scored_response in zip(scoring_tasks, scored_responses):
+        for uid, scored_response in scored_responses:
+            # uids without a reference answer are left unscored
             if scored_response is not None:
-                scores[uid] = scored_response
                 uid_scores_dict[uid] = scored_response
-            else:
-                scores[uid] = 0
-                uid_scores_dict[uid] = 0
             # self.wandb_data["scores"][uid] = score
 
         if uid_scores_dict != {}:
+            # Write all scores into the tensor with a single scatter
+            uids = torch.as_tensor(list(uid_scores_dict.keys()), dtype=torch.long)
+            values = torch.as_tensor(list(uid_scores_dict.values()), dtype=scores.dtype)
+            scores.index_put_((uids,), values)
             bt.logging.info(f"text_scores is {uid_scores_dict}")
         return scores, uid_scores_dict, self.wandb_data
 
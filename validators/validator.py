@@ -35,6 +35,9 @@ EXPECTED_ACCESS_KEY = "hello"
 def get_config():
     parser = argparse.ArgumentParser()
     parser.add_argument("--netuid", type=int, default=18)
+    parser.add_argument("--max_concurrency", type=int, default=256, help="Maximum number of concurrent miner queries per text validator round.")
+    parser.add_argument("--max_openai_concurrency", type=int, default=256, help="Maximum number of concurrent openai calls per text validator round.")
+    parser.add_argument("--openai_batch_threshold", type=int, default=0, help="Score text rounds with at least this many responses through the OpenAI Batch API (e.g. 20). 0 disables it.")
     parser.add_argument('--wandb_off', action='store_false', dest='wandb_on')
     parser.set_defaults(wandb_on=True)
     bt.subtensor.add_args(parser)